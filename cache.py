@@ -0,0 +1,80 @@
+"""
+Cache Helper Functions
+
+Redis-backed cache for read-heavy API responses.
+Caching is disabled (every lookup is a miss) when REDIS_URL is not set or Redis is unreachable.
+"""
+
+import hashlib
+import os
+from typing import Any, List, Optional
+
+import orjson
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+try:
+    from redis.exceptions import RedisError
+except ImportError:  # redis not installed; cache stays disabled
+    RedisError = Exception
+
+cache = None
+
+redis_url = os.getenv("REDIS_URL")
+cache_ttl = int(os.getenv("CACHE_TTL", 60))
+# Short timeouts so an unreachable Redis costs a few ms per call, not a hung TCP connect
+cache_timeout = float(os.getenv("CACHE_TIMEOUT", 0.05))
+cache_connect_timeout = float(os.getenv("CACHE_CONNECT_TIMEOUT", 0.1))
+
+if redis_url:
+    from redis.asyncio import Redis
+    cache = Redis.from_url(
+        redis_url,
+        socket_timeout=cache_timeout,
+        socket_connect_timeout=cache_connect_timeout,
+    )
+
+def make_key(prefix: str, *parts: Any) -> str:
+    """Build a stable cache key (identical across worker processes)"""
+    digest = hashlib.blake2b(orjson.dumps(parts), digest_size=8).hexdigest()
+    return f"{prefix}:{digest}"
+
+async def cache_get(key: str) -> Optional[Any]:
+    """Return the cached value for key, or None on miss"""
+    if cache is None:
+        return None
+    try:
+        raw = await cache.get(key)
+    except RedisError:
+        return None
+    return orjson.loads(raw) if raw is not None else None
+
+async def cache_set(key: str, value: Any, ttl: int = cache_ttl):
+    """Store a JSON-serializable value under key with a TTL in seconds"""
+    if cache is None:
+        return
+    try:
+        await cache.set(key, orjson.dumps(value), ex=ttl)
+    except RedisError:
+        pass
+
+async def get_versions(*names: str) -> List[int]:
+    """Current version counters; embed them in keys so a bump invalidates without SCAN"""
+    if cache is None:
+        return [0] * len(names)
+    try:
+        values = await cache.mget([f"ver:{n}" for n in names])
+    except RedisError:
+        return [0] * len(names)
+    return [int(v) if v else 0 for v in values]
+
+async def bump_version(name: str):
+    """Invalidate every key built from the named version counter"""
+    if cache is None:
+        return
+    try:
+        await cache.incr(f"ver:{name}")
+    except RedisError:
+        pass
@@ -1,22 +1,56 @@
+import hashlib
+import logging
 import os
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from typing import List, Optional, Literal
-from fastapi import FastAPI, HTTPException, Query
+import orjson
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
 
 from database import db, create_document, get_documents
+from cache import make_key, cache_get, cache_set, get_versions, bump_version
 
-app = FastAPI(title="OTT Streaming API", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_indexes()
+    yield
+
+app = FastAPI(
+    title="OTT Streaming API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+# Explicit origins: "*" with credentials makes Starlette echo Origin per request
+CORS_ORIGINS = [
+    o.strip() for o in os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:5173").split(",") if o.strip()
+]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,
 )
 
+# Added after CORS so it wraps it and compresses the final response
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # ---------- Models ----------
 class ContentIn(BaseModel):
     title: str
@@ -38,6 +72,10 @@ class ContentIn(BaseModel):
 class ContentOut(ContentIn):
     id: str
 
+class ContentPage(BaseModel):
+    items: List[ContentOut]
+    next: Optional[str] = None
+
 class UserProfileIn(BaseModel):
     uid: str
     display_name: Optional[str] = None
@@ -50,6 +88,19 @@ class UserProfileOut(UserProfileIn):
 
 # ---------- Helpers ----------
 
+# 24-char hex ObjectId; validates the list_content cursor and content-id path params
+_OID = re.compile(r"^[0-9a-fA-F]{24}\Z")
+
+# Only fetch what the response models expose (skips heavy fields like episodes)
+CONTENT_PROJ = {f: 1 for f in ContentIn.model_fields}
+PROFILE_PROJ = {"_id": 0, **{f: 1 for f in UserProfileOut.model_fields}}
+
+def parse_oid(value: str) -> ObjectId:
+    """Parse a 24-char hex id, rejecting malformed ones with 422 instead of raising InvalidId"""
+    if not _OID.match(value):
+        raise HTTPException(422, "Invalid id")
+    return ObjectId(value)
+
 def to_id(doc: dict) -> dict:
     if not doc:
         return doc
@@ -58,14 +109,118 @@ def to_id(doc: dict) -> dict:
         d["id"] = str(d.pop("_id"))
     return d
 
+def _fix(d: dict) -> dict:
+    """In-place to_id for cursor results, which nothing else holds a reference to"""
+    d["id"] = str(d.pop("_id"))
+    return d
+
+# /test reporting, resolved once at import instead of per request
+_DB_URL_STATUS = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+_DB_NAME_STATUS = os.getenv("DATABASE_NAME") or "❌ Not Set"
+_COLLECTIONS_TTL = 30
+_collections_cache = (0.0, [])
+
+async def list_collections_cached() -> list:
+    """Collection names, refreshed at most every _COLLECTIONS_TTL seconds"""
+    global _collections_cache
+    expires, names = _collections_cache
+    if time.monotonic() >= expires:
+        names = await db.list_collection_names()
+        _collections_cache = (time.monotonic() + _COLLECTIONS_TTL, names)
+    return names
+
+CATALOG_CACHE_CONTROL = "public, max-age=30, stale-while-revalidate=120"
+# Recommendations are per-user: browsers may reuse them, shared caches may not
+PERSONAL_CACHE_CONTROL = "private, max-age=30"
+
+def conditional_response(request: Request, response: Response, payload, items: list, cache_control: str):
+    """Tag a list payload with an ETag over its ids; 304 when the client already has it"""
+    etag = '"%s"' % hashlib.blake2b(orjson.dumps([d["id"] for d in items]), digest_size=8).hexdigest()
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag in [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return payload
+
+def recommendation_pipeline(uid: str, limit: int) -> list:
+    """Profile -> favorite genres -> latest published content in those genres, in one round-trip"""
+    return [
+        {"$match": {"uid": uid}},
+        {"$limit": 1},
+        # favorites are stored as id strings; malformed ones convert to null and are dropped
+        {"$project": {"fav_ids": {"$filter": {
+            "input": {"$map": {
+                "input": {"$ifNull": ["$favorites", []]},
+                "in": {"$convert": {"input": "$$this", "to": "objectId", "onError": None, "onNull": None}},
+            }},
+            "cond": {"$ne": ["$$this", None]},
+        }}}},
+        {"$lookup": {
+            "from": "content",
+            "localField": "fav_ids",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"genres": 1, "_id": 0}}],
+            "as": "favs",
+        }},
+        {"$project": {"genres": {"$reduce": {
+            "input": "$favs.genres",
+            "initialValue": [],
+            "in": {"$setUnion": ["$$value", {"$ifNull": ["$$this", []]}]},
+        }}}},
+        {"$lookup": {
+            "from": "content",
+            "let": {"g": "$genres"},
+            "pipeline": [
+                {"$match": {"is_published": True}},
+                # no favorite genres -> every published title qualifies
+                {"$match": {"$expr": {"$or": [
+                    {"$eq": [{"$size": "$$g"}, 0]},
+                    {"$gt": [{"$size": {"$setIntersection": [{"$ifNull": ["$genres", []]}, "$$g"]}}, 0]},
+                ]}}},
+                {"$sort": {"created_at": -1}},
+                {"$limit": limit},
+                {"$project": CONTENT_PROJ},
+            ],
+            "as": "recs",
+        }},
+        {"$unwind": "$recs"},
+        {"$replaceRoot": {"newRoot": "$recs"}},
+    ]
+
+# ---------- Startup ----------
+
+async def ensure_indexes():
+    if db is None:
+        return
+    # Equality filters first, then the sort key, so list queries are IXSCAN + LIMIT
+    # with no in-memory SORT: list_content sorts by _id. Recommendations walk
+    # is_published/created_at; their genre match is an $expr, which can't use an index
+    await db["content"].create_index([("is_published", 1), ("_id", -1)])
+    await db["content"].create_index([("is_published", 1), ("genres", 1), ("_id", -1)])
+    await db["content"].create_index([("is_published", 1), ("type", 1), ("_id", -1)])
+    await db["content"].create_index([("is_published", 1), ("created_at", -1)])
+    await db["content"].create_index(
+        [("title", "text"), ("description", "text")], default_language="english"
+    )
+    try:
+        await db["userprofile"].create_index("uid", unique=True)
+    except OperationFailure as e:
+        # Older get_user could race and insert duplicate profiles; keep serving until they are merged
+        logger.warning("Unique index on userprofile.uid not created: %s", e)
+    await db["userprofile"].create_index([("uid", 1), ("history.content_id", 1)])
+
 # ---------- Routes ----------
 
 @app.get("/")
-def root():
+async def root():
     return {"service": "OTT API", "status": "ok"}
 
+@app.get("/healthz")
+async def healthz():
+    return {"ok": True}
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -77,10 +232,10 @@ def test_database():
     try:
         if db is not None:
             response["database"] = "✅ Available"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = os.getenv("DATABASE_NAME") or "❌ Not Set"
+            response["database_url"] = _DB_URL_STATUS
+            response["database_name"] = _DB_NAME_STATUS
             try:
-                collections = db.list_collection_names()
+                collections = await list_collections_cached()
                 response["collections"] = collections[:10]
                 response["connection_status"] = "Connected"
                 response["database"] = "✅ Connected & Working"
@@ -93,93 +248,140 @@ def test_database():
     return response
 
 # ---- Content Catalog ----
-@app.get("/api/content", response_model=List[ContentOut])
-def list_content(
+@app.get("/api/content", response_model=ContentPage)
+async def list_content(
+    request: Request,
+    response: Response,
     q: Optional[str] = None,
     genre: Optional[str] = None,
     type: Optional[str] = None,
-    skip: int = 0,
-    limit: int = Query(default=20, le=100)
+    after: Optional[str] = None,
+    limit: int = Query(default=20, ge=1, le=100)
 ):
     if db is None:
-        return []
+        return {"items": [], "next": None}
     filt = {"is_published": True}
     if q:
-        # Simple title search
-        filt["title"] = {"$regex": q, "$options": "i"}
+        # Indexed full-text search over title/description
+        filt["$text"] = {"$search": q}
     if genre:
         filt["genres"] = genre
     if type:
         filt["type"] = type
-    cursor = db["content"].find(filt).skip(skip).limit(limit).sort("created_at", -1)
-    return [to_id(x) for x in cursor]
+    if after:
+        # Opaque cursor: the last id of the previous page
+        if not _OID.match(after):
+            raise HTTPException(422, "Invalid cursor")
+        filt["_id"] = {"$lt": ObjectId(after)}
+    (ver,) = await get_versions("content")
+    key = make_key(f"list:v{ver}", q, genre, type, after, limit)
+    cached = await cache_get(key)
+    if cached is not None:
+        return conditional_response(request, response, cached, cached["items"], CATALOG_CACHE_CONTROL)
+    # batch_size(limit): the whole page arrives in a single network batch
+    cursor = db["content"].find(filt, CONTENT_PROJ).sort("_id", -1).limit(limit).batch_size(limit)
+    items = [_fix(x) async for x in cursor]
+    page = {"items": items, "next": items[-1]["id"] if items else None}
+    await cache_set(key, page)
+    return conditional_response(request, response, page, items, CATALOG_CACHE_CONTROL)
 
 @app.post("/api/content", response_model=dict)
-def create_content(payload: ContentIn):
+async def create_content(payload: ContentIn):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    new_id = create_document("content", payload.model_dump())
+    new_id = await create_document("content", payload.model_dump())
+    await bump_version("content")
     return {"id": new_id}
 
 @app.get("/api/content/{content_id}", response_model=ContentOut)
-def get_content(content_id: str):
+async def get_content(request: Request, response: Response, content_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    try:
-        doc = db["content"].find_one({"_id": ObjectId(content_id)})
-    except Exception:
-        raise HTTPException(404, "Invalid id")
+    oid = parse_oid(content_id)
+    doc = await db["content"].find_one({"_id": oid}, CONTENT_PROJ)
     if not doc:
         raise HTTPException(404, "Not found")
+    # There is no update endpoint, so the id's creation time is the last modification
+    # bson's own UTC tzinfo isn't accepted by format_datetime(usegmt=True)
+    created = oid.generation_time.astimezone(timezone.utc)
+    headers = {"Last-Modified": format_datetime(created, usegmt=True), "Cache-Control": CATALOG_CACHE_CONTROL}
+    since = request.headers.get("if-modified-since")
+    if since:
+        try:
+            if created <= parsedate_to_datetime(since):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    response.headers.update(headers)
     return to_id(doc)
 
 @app.delete("/api/content/{content_id}")
-def delete_content(content_id: str):
+async def delete_content(content_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    try:
-        res = db["content"].delete_one({"_id": ObjectId(content_id)})
-    except Exception:
-        raise HTTPException(404, "Invalid id")
+    res = await db["content"].delete_one({"_id": parse_oid(content_id)})
     if res.deleted_count == 0:
         raise HTTPException(404, "Not found")
+    await bump_version("content")
     return {"deleted": True}
 
 # ---- User Profiles ----
 @app.get("/api/users/{uid}", response_model=UserProfileOut)
-def get_user(uid: str):
+async def get_user(uid: str):
     if db is None:
         raise HTTPException(500, "Database not configured")
-    prof = db["userprofile"].find_one({"uid": uid})
-    if not prof:
-        # Auto-create minimal profile
-        profile = UserProfileOut(uid=uid)
-        create_document("userprofile", profile.model_dump())
-        prof = db["userprofile"].find_one({"uid": uid})
-    return UserProfileOut(**{
+    # Fetch, auto-creating a minimal profile on first access
+    now = datetime.now(timezone.utc)
+    profile = {
+        "uid": uid,
+        "display_name": None,
+        "avatar_url": None,
+        "favorites": [],
+        "history": [],
+        "preferences": {},
+        "created_at": now,
+        "updated_at": now,
+    }
+    prof = await db["userprofile"].find_one_and_update(
+        {"uid": uid},
+        {"$setOnInsert": profile},
+        projection=PROFILE_PROJ,
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    # Plain dict: response_model validates it exactly once
+    return {
         "uid": prof.get("uid"),
         "display_name": prof.get("display_name"),
         "avatar_url": prof.get("avatar_url"),
         "favorites": prof.get("favorites", []),
         "history": prof.get("history", []),
         "preferences": prof.get("preferences", {}),
-    })
+    }
 
 @app.post("/api/users/{uid}/favorites")
-def toggle_favorite(uid: str, content_id: str):
+async def toggle_favorite(uid: str, content_id: str):
     if db is None:
         raise HTTPException(500, "Database not configured")
-    prof = db["userprofile"].find_one({"uid": uid})
-    if not prof:
-        raise HTTPException(404, "Profile not found")
-    favs = set(prof.get("favorites", []))
-    if content_id in favs:
-        favs.remove(content_id)
-        action = "removed"
-    else:
-        favs.add(content_id)
+    # Pull if present, otherwise add; each step is a single atomic update
+    prof = await db["userprofile"].find_one_and_update(
+        {"uid": uid, "favorites": content_id},
+        {"$pull": {"favorites": content_id}},
+        projection={"_id": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    action = "removed"
+    if prof is None:
+        prof = await db["userprofile"].find_one_and_update(
+            {"uid": uid},
+            {"$addToSet": {"favorites": content_id}},
+            projection={"_id": 1},
+            return_document=ReturnDocument.AFTER,
+        )
         action = "added"
-    db["userprofile"].update_one({"uid": uid}, {"$set": {"favorites": list(favs)}})
+    if prof is None:
+        raise HTTPException(404, "Profile not found")
+    await bump_version(f"favorites:{uid}")
     return {"status": "ok", "action": action}
 
 class WatchEntry(BaseModel):
@@ -187,59 +389,76 @@ class WatchEntry(BaseModel):
     progress: float = Field(ge=0, le=1)
 
 @app.post("/api/users/{uid}/history")
-def update_history(uid: str, entry: WatchEntry):
+async def update_history(uid: str, entry: WatchEntry):
     if db is None:
         raise HTTPException(500, "Database not configured")
-    prof = db["userprofile"].find_one({"uid": uid})
-    if not prof:
-        raise HTTPException(404, "Profile not found")
-    history = prof.get("history", [])
-    # upsert by content_id
-    found = False
-    for h in history:
-        if h.get("content_id") == entry.content_id:
-            h["progress"] = entry.progress
-            found = True
-            break
-    if not found:
-        history.append({"content_id": entry.content_id, "progress": entry.progress})
-    db["userprofile"].update_one({"uid": uid}, {"$set": {"history": history}})
+    # upsert by content_id: update the matching entry in place, else append
+    matched = {"uid": uid, "history.content_id": entry.content_id}
+    set_progress = {"$set": {"history.$.progress": entry.progress}}
+    res = await db["userprofile"].update_one(matched, set_progress)
+    if res.matched_count == 0:
+        # $ne guard: a concurrent first write can't append the same content_id twice
+        res = await db["userprofile"].update_one(
+            {"uid": uid, "history.content_id": {"$ne": entry.content_id}},
+            {"$push": {"history": {"content_id": entry.content_id, "progress": entry.progress}}},
+        )
+        if res.matched_count == 0:
+            # Lost the race to another append (entry now exists), or no such profile
+            res = await db["userprofile"].update_one(matched, set_progress)
+            if res.matched_count == 0:
+                raise HTTPException(404, "Profile not found")
     return {"status": "ok"}
 
 # ---- Recommendations (simple) ----
 @app.get("/api/recommendations", response_model=List[ContentOut])
-def recommendations(uid: Optional[str] = None, limit: int = 12):
+async def recommendations(
+    request: Request,
+    response: Response,
+    uid: Optional[str] = None,
+    limit: int = Query(default=12, ge=1, le=100)
+):
     if db is None:
         return []
+    content_ver, fav_ver = await get_versions("content", f"favorites:{uid}")
+    key = make_key(f"rec:v{content_ver}.{fav_ver}", uid, limit)
+    cached = await cache_get(key)
+    if cached is not None:
+        return conditional_response(request, response, cached, cached, PERSONAL_CACHE_CONTROL)
     # naive: use favorites genres if any, else latest
-    filt = {"is_published": True}
+    items = None
     if uid:
-        prof = db["userprofile"].find_one({"uid": uid})
-        fav_ids = set((prof or {}).get("favorites", []))
-        if fav_ids:
-            fav_docs = db["content"].find({"_id": {"$in": [ObjectId(i) for i in fav_ids if ObjectId.is_valid(i)]}})
-            genres = set()
-            for d in fav_docs:
-                for g in d.get("genres", []):
-                    genres.add(g)
-            if genres:
-                filt["genres"] = {"$in": list(genres)}
-    cursor = db["content"].find(filt).limit(limit).sort("created_at", -1)
-    return [to_id(x) for x in cursor]
+        cursor = db["userprofile"].aggregate(recommendation_pipeline(uid, limit), batchSize=limit)
+        recs = [_fix(x) async for x in cursor]
+        if recs or await db["userprofile"].count_documents({"uid": uid}, limit=1):
+            items = recs
+    if items is None:
+        cursor = (
+            db["content"].find({"is_published": True}, CONTENT_PROJ)
+            .sort("created_at", -1).limit(limit).batch_size(limit)
+        )
+        items = [_fix(x) async for x in cursor]
+    await cache_set(key, items)
+    return conditional_response(request, response, items, items, PERSONAL_CACHE_CONTROL)
 
 # ---- Admin analytics (basic) ----
 @app.get("/api/admin/metrics")
-def admin_metrics():
+async def admin_metrics():
     if db is None:
         return {"content_count": 0, "users": 0, "favorites": 0}
-    content_count = db["content"].count_documents({})
-    users = db["userprofile"].count_documents({})
-    favs = 0
-    for u in db["userprofile"].find({}, {"favorites": 1}):
-        favs += len(u.get("favorites", []))
+    # Collection metadata counts are close enough for a dashboard
+    content_count = await db["content"].estimated_document_count()
+    users = await db["userprofile"].estimated_document_count()
+    pipeline = [
+        {"$project": {"n": {"$size": {"$ifNull": ["$favorites", []]}}}},
+        {"$group": {"_id": None, "total": {"$sum": "$n"}}},
+    ]
+    totals = await db["userprofile"].aggregate(pipeline).to_list(length=1)
+    favs = totals[0]["total"] if totals else 0
     return {"content_count": content_count, "users": users, "favorites": favs}
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", min(os.cpu_count() or 1, 8)))
+    # Import string so each worker process builds its own app and Mongo client
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers, loop="uvloop", http="httptools")
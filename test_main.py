@@ -0,0 +1,86 @@
+"""
+Smoke tests for the API routes
+
+Run with: python -m pytest -q (needs requirements-dev.txt)
+"""
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import main
+
+class FakeCollection:
+    """Minimal async stand-in for a Motor collection"""
+
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+
+    async def create_index(self, *args, **kwargs):
+        return "index"
+
+    async def find_one(self, filt, projection=None):
+        for d in self.docs:
+            if all(d.get(k) == v for k, v in filt.items()):
+                return dict(d)
+        return None
+
+class FakeResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+class FakeContent(FakeCollection):
+    async def delete_one(self, filt):
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if d["_id"] != filt["_id"]]
+        return FakeResult(before - len(self.docs))
+
+OID = ObjectId()
+
+@pytest.fixture
+def client(monkeypatch):
+    fake_db = {
+        "content": FakeContent([{"_id": OID, "title": "Heat", "type": "movie", "is_published": True}]),
+        "userprofile": FakeCollection(),
+    }
+    monkeypatch.setattr(main, "db", fake_db)
+    with TestClient(main.app) as c:
+        yield c
+
+def test_get_content_by_valid_id(client):
+    res = client.get(f"/api/content/{OID}")
+    assert res.status_code == 200
+    assert res.json()["id"] == str(OID)
+    assert res.json()["title"] == "Heat"
+
+def test_get_content_unknown_id_is_404(client):
+    res = client.get(f"/api/content/{ObjectId()}")
+    assert res.status_code == 404
+
+def test_get_content_malformed_id_is_422(client):
+    res = client.get("/api/content/not-an-id")
+    assert res.status_code == 422
+
+def test_delete_content(client):
+    assert client.delete("/api/content/not-an-id").status_code == 422
+    assert client.delete(f"/api/content/{OID}").json() == {"deleted": True}
+    assert client.delete(f"/api/content/{OID}").status_code == 404
+
+def test_get_content_last_modified_and_304(client):
+    res = client.get(f"/api/content/{OID}")
+    last_modified = res.headers["last-modified"]
+    assert last_modified.endswith(" GMT")
+    assert "max-age=30" in res.headers["cache-control"]
+
+    res = client.get(f"/api/content/{OID}", headers={"If-Modified-Since": last_modified})
+    assert res.status_code == 304
+    assert res.content == b""
+    assert res.headers["last-modified"] == last_modified
+
+def test_get_content_modified_since_older_date_is_200(client):
+    res = client.get(f"/api/content/{OID}", headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"})
+    assert res.status_code == 200
+
+def test_get_content_bad_if_modified_since_is_ignored(client):
+    res = client.get(f"/api/content/{OID}", headers={"If-Modified-Since": "yesterday"})
+    assert res.status_code == 200